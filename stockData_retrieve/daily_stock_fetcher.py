@@ -1,11 +1,13 @@
+import orjson
 import pandas as pd
 import requests
-from sqlalchemy import create_engine
-from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+import sqlite3
+from datetime import date, datetime, timedelta, timezone
+import functools
 import os
 import time
-import pytz 
-import holidays # Library for accurate holiday checking
+from zoneinfo import ZoneInfo
 
 # --- Google Coding Style ---
 
@@ -15,14 +17,59 @@ TABLE_NAME = "twse_daily_price"
 TWSE_URL = "https://www.twse.com.tw/exchangeReport/MI_INDEX?response=json&date={date}&type=ALLBUT0999"
 # The folder where the script is running and files are stored
 DATA_FOLDER = "stockData" 
-TZ_TAIPEI = pytz.timezone('Asia/Taipei')
+# Each daily DB file is rebuilt from scratch on every run, so durability
+# can be traded for write speed while loading it
+SQLITE_BULK_LOAD_PRAGMAS = (
+    "PRAGMA journal_mode=MEMORY",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+)
+TZ_TAIPEI = ZoneInfo('Asia/Taipei')
+# Data is usually available after 16:00 TST (4:00 PM)
+MARKET_DATA_CUTOFF_HOUR = 16
+# Smallest sizes of a day's files that still hold real data; anything
+# smaller is fetched again. A full day is ~170 KB as .db but only a few
+# tens of KB as zstd Parquet, so each format gets its own floor.
+MIN_DB_FILE_SIZE = 10_000
+MIN_PARQUET_FILE_SIZE = 5_000
+# Keep-alive connections reused for every TWSE request in this process
+HTTP_POOL_SIZE = 4
+# Seconds to wait for TWSE before giving up on a request
+TWSE_REQUEST_TIMEOUT = 30
 
-# Define Taiwan holidays instance once for efficiency
-# We check a range of years to cover past and future data checks
-TW_HOLIDAYS = holidays.TW(years=range(datetime.now().year - 2, datetime.now().year + 2))
+# Shared HTTP session so repeated TWSE requests reuse the TLS connection
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
 
 # --- Helper Functions ---
 
+@functools.cache
+def _holiday_set() -> frozenset:
+  """
+  Builds the Taiwan holiday dates once, on first use, so importing this
+  module does not pay for the holidays library and its tables.
+  """
+  import holidays # Library for accurate holiday checking
+
+  # We check a range of years to cover past and future data checks
+  this_year = datetime.now().year
+  # Materialized as a plain frozenset so lookups skip the library's per-call
+  # date coercion and year expansion
+  return frozenset(holidays.TW(years=range(this_year - 2, this_year + 2)).keys())
+
+def _is_trading_date(day: date) -> bool:
+  """Weekend and holiday check shared by is_trading_day and the cached walk back."""
+  # 1. Check for weekend (Saturday=5, Sunday=6)
+  if day.weekday() >= 5:
+    return False
+  
+  # 2. Check for public holidays (pre-computed from the holidays library)
+  if day in _holiday_set():
+    return False
+    
+  return True
+
 def is_trading_day(target_date: datetime) -> bool:
   """
   Checks if the given date is a trading day (not a weekend and not a market holiday).
@@ -33,34 +80,39 @@ def is_trading_day(target_date: datetime) -> bool:
   Returns:
     True if it is a trading day, False otherwise.
   """
-  date_only = target_date.date()
-  
-  # 1. Check for weekend (Saturday=5, Sunday=6)
-  if target_date.weekday() >= 5:
-    return False
-  
-  # 2. Check for public holidays using the holidays library
-  if date_only in TW_HOLIDAYS:
-    return False
-    
-  return True
+  return _is_trading_date(target_date.date())
+
+@functools.lru_cache(maxsize=1024)
+def _last_trading_day_ordinal(date_ordinal: int) -> int:
+  """Memoized walk back to the most recent trading day, keyed by date ordinal."""
+  target_date = date.fromordinal(date_ordinal)
+
+  while not _is_trading_date(target_date):
+    target_date -= timedelta(days=1)
+
+  return target_date.toordinal()
 
 def find_last_trading_day(current_date: datetime) -> datetime:
   """
   Finds the most recent trading day using the holidays library.
   """
-  target_date = current_date
-  
-  while not is_trading_day(target_date):
-    target_date -= timedelta(days=1)
-    
-  return target_date
+  date_ordinal = current_date.toordinal()
+  days_back = date_ordinal - _last_trading_day_ordinal(date_ordinal)
+  return current_date - timedelta(days=days_back)
+
+def is_data_complete(file_path: str, min_size: int) -> bool:
+  """Checks with a single stat() that a data file exists and is larger than min_size."""
+  try:
+    return os.stat(file_path).st_size > min_size
+  except FileNotFoundError:
+    return False
 
 def is_data_fetched(target_date: datetime) -> bool:
-  """Checks if the data file for the target date already exists."""
+  """Checks if complete .db and .parquet files for the target date already exist."""
   date_str = target_date.strftime('%Y%m%d')
-  file_path = os.path.join(DATA_FOLDER, f"stock_data_{date_str}.db")
-  return os.path.exists(file_path)
+  file_path_base = os.path.join(DATA_FOLDER, f"stock_data_{date_str}")
+  return (is_data_complete(f"{file_path_base}.db", MIN_DB_FILE_SIZE) and
+          is_data_complete(f"{file_path_base}.parquet", MIN_PARQUET_FILE_SIZE))
 
 def fetch_twse_daily_summary(target_date: str) -> pd.DataFrame:
   """
@@ -75,9 +127,10 @@ def fetch_twse_daily_summary(target_date: str) -> pd.DataFrame:
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
         'Referer': 'https://www.twse.com.tw/' 
     } 
-    response = requests.get(url, headers=headers)
+    response = SESSION.get(url, headers=headers, timeout=TWSE_REQUEST_TIMEOUT)
     response.raise_for_status()
-    data = response.json()
+    # orjson 直接解析 bytes，比 response.json() 的標準 json 模組快
+    data = orjson.loads(response.content)
 
     # mother data
     if 'tables' in data and data['tables']:
@@ -126,6 +179,10 @@ def fetch_twse_daily_summary(target_date: str) -> pd.DataFrame:
   except requests.RequestException as e:
     print(f"Error making request to TWSE: {e}")
     return pd.DataFrame()
+  except orjson.JSONDecodeError as e:
+    # TWSE 被限流時會回傳 HTML 而非 JSON
+    print(f"Error decoding TWSE response: {e}")
+    return pd.DataFrame()
 
 
 def save_to_sqlite(df: pd.DataFrame, target_date: datetime):
@@ -148,9 +205,30 @@ def save_to_sqlite(df: pd.DataFrame, target_date: datetime):
   
   print(f"DEBUG: Calculated ABSOLUTE Path: {db_file_path_abs}") 
   
-  # 使用絕對路徑連接資料庫
-  engine = create_engine(f"sqlite:///{db_file_path_abs}")
-  df.to_sql(TABLE_NAME, engine, if_exists='replace', index=False)
+  # 先寫入暫存檔，完成後再以 os.replace 原子性地換上，
+  # 中斷的寫入 (synchronous=OFF 下可能損毀) 不會留下看似完整的 .db 檔
+  db_file_path_tmp = f"{db_file_path_abs}.tmp"
+  if os.path.exists(db_file_path_tmp):
+    os.remove(db_file_path_tmp)
+
+  # 使用絕對路徑連接資料庫 (直接用 sqlite3，省去 SQLAlchemy engine 的建立成本)
+  connection = sqlite3.connect(db_file_path_tmp)
+  try:
+    for pragma in SQLITE_BULK_LOAD_PRAGMAS:
+      connection.execute(pragma)
+    # 使用多列 INSERT 批次寫入，避免逐列 INSERT 的大量 SQL 往返
+    # 每批列數 x 欄位數不可超過此 SQLite 版本的參數上限
+    max_variables = connection.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    chunksize = max(1, max_variables // len(df.columns))
+    # pandas 會把所有 INSERT 包在單一交易中，只在最後 COMMIT 一次
+    df.to_sql(TABLE_NAME, connection, if_exists='replace', index=False,
+              method='multi', chunksize=chunksize)
+  finally:
+    connection.close()
+  # synchronous=OFF 不會 fsync，換檔前自行 fsync 一次確保內容已落盤
+  with open(db_file_path_tmp, 'rb') as tmp_file:
+    os.fsync(tmp_file.fileno())
+  os.replace(db_file_path_tmp, db_file_path_abs)
   
   print(f"--- Save Complete ---")
   print(f"New file saved successfully at: '{db_file_path_abs}'.")
@@ -160,32 +238,52 @@ def save_to_sqlite(df: pd.DataFrame, target_date: datetime):
   #df.to_csv(csv_file_path, index=False, encoding='utf-8-sig')
   #print(f"CSV file saved successfully at: '{csv_file_path}'.")
 
+def save_to_parquet(df: pd.DataFrame, target_date: datetime):
+  """
+  Saves the DataFrame as a date-stamped, zstd-compressed Parquet file next to
+  the SQLite file. The data is the raw TWSE table (string columns, Chinese
+  headers) until the cleaning step is enabled.
+  """
+  if df.empty:
+    print("DataFrame is empty. Skipping Parquet save.")
+    return
+
+  date_str = target_date.strftime('%Y%m%d')
+  os.makedirs(DATA_FOLDER, exist_ok=True)
+  parquet_file_path = os.path.join(DATA_FOLDER, f"stock_data_{date_str}.parquet")
+  # 與 .db 相同，先寫暫存檔再換上，確保存在的檔案都是完整的
+  parquet_file_path_tmp = f"{parquet_file_path}.tmp"
+  df.to_parquet(parquet_file_path_tmp, compression='zstd', index=False)
+  os.replace(parquet_file_path_tmp, parquet_file_path)
+  print(f"Parquet file saved successfully at: '{parquet_file_path}'.")
+
 # --- MAIN ORCHESTRATION ---
 
 def main():
   """
   Main function to execute the scheduled intelligent fetching process.
   """
-  # Get current time in Taipei timezone
+  # Get current time in Taipei timezone (唯一一次讀取系統時鐘)
   now_tst = datetime.now(TZ_TAIPEI)
   today_tst = now_tst.replace(hour=0, minute=0, second=0, microsecond=0)
   
   # Data is usually available after 16:00 TST (4:00 PM)
-  CUTOFF_TIME = now_tst.replace(hour=16, minute=0, second=0, microsecond=0)
+  is_past_cutoff = now_tst.hour >= MARKET_DATA_CUTOFF_HOUR
+  is_today_trading_day = is_trading_day(today_tst)
   
   # 偵錯：打印環境時間
   print(f"\n--- DEBUG: Environment Time Check ---")
-  print(f"Action Runner Time (UTC): {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}")
+  print(f"Action Runner Time (UTC): {now_tst.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')}")
   print(f"Taipei Time (TST): {now_tst.strftime('%Y-%m-%d %H:%M:%S')}")
-  print(f"Is past 4 PM TST: {now_tst >= CUTOFF_TIME}")
-  print(f"Is today a trading day: {is_trading_day(today_tst)}")
+  print(f"Is past 4 PM TST: {is_past_cutoff}")
+  print(f"Is today a trading day: {is_today_trading_day}")
 
   target_fetch_date = None
   
   # 決定要檢查和擷取的目標日期
-  if is_trading_day(today_tst) and now_tst >= CUTOFF_TIME:
+  if is_today_trading_day and is_past_cutoff:
     target_check_date = today_tst # 情境 A: 交易日且已過收盤後
-  elif is_trading_day(today_tst) and now_tst < CUTOFF_TIME:
+  elif is_today_trading_day:
     target_check_date = find_last_trading_day(today_tst - timedelta(days=1)) # 情境 B: 交易日但未收盤
   else:
     target_check_date = find_last_trading_day(today_tst) # 情境 C: 非交易日
@@ -206,6 +304,7 @@ def main():
         market_df = fetch_twse_daily_summary(target_check_date.strftime('%Y%m%d')) 
         if not market_df.empty:
             save_to_sqlite(market_df, target_check_date)
+            save_to_parquet(market_df, target_check_date)
             '''
             # Data Sample for printf practice (包含不同的型別：字串、浮點數、整數)
             print("\nData Sample (for struct & printf practice):")